@@ -5,32 +5,55 @@ This script reads markdown files from /docs, chunks them into 500-token pieces
 with 150-token overlap, generates embeddings using Sentence Transformers, and stores them in Qdrant.
 
 Usage:
-    python ingest.py --docs-dir ../docs [--force] [--collection-name <name>]
+    python ingest.py --docs-dir ../docs [--force] [--collection-name <name>] [--no-cache]
 
 Features:
     - Markdown-aware chunking (preserves headers)
     - Metadata extraction (source, chapter, section, token positions)
-    - Batch processing with rate limiting
+    - Concurrent batch upload to Qdrant
     - Error handling with exponential backoff retry
     - Local embedding generation (no API required)
+    - Content-hash embedding cache for incremental re-ingests
 """
 
 import os
+import re
 import sys
 import time
+import asyncio
+import sqlite3
+import hashlib
 import argparse
+from contextlib import closing
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
 from tqdm import tqdm
+import numpy as np
 import tiktoken
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    Distance,
+    VectorParams,
+    PointStruct,
+    OptimizersConfigDiff,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+)
 
 # Load environment variables
 load_dotenv()
 
+# CPU threads for the embedding model. OpenMP reads OMP_NUM_THREADS when torch
+# is first imported (by sentence_transformers), so it must be set beforehand.
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", str(os.cpu_count() or 4)))
+os.environ.setdefault("OMP_NUM_THREADS", str(EMBEDDING_THREADS))
+
+from sentence_transformers import SentenceTransformer  # noqa: E402
+
 # Configuration from environment
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
@@ -38,19 +61,116 @@ COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "robotics_textbook_chunks"
 EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIMENSION", "768"))
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "500"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", "10"))
-BATCH_DELAY = float(os.getenv("BATCH_DELAY_SECONDS", "1.0"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "64"))
+# Qdrant's default; indexing is disabled (0) while bulk uploading
+INDEXING_THRESHOLD = int(os.getenv("INDEXING_THRESHOLD", "20000"))
+UPLOAD_PARALLEL = int(os.getenv("UPLOAD_PARALLEL", "4"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+TOKENIZER_THREADS = os.cpu_count() or 8
+READ_WORKERS = 16
+MARKDOWN_SUFFIXES = {".md", ".mdx"}
+# Optional directory holding an ONNX export of all-mpnet-base-v2 (see OnnxEmbeddingModel)
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR")
+# On-disk content-hash -> vector cache used to skip re-embedding unchanged chunks
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".embedding_cache.db")
+
+# Built once at import and shared by every document (construction is expensive)
+TOKENIZER = tiktoken.get_encoding("cl100k_base")
+
+# Markdown header line; captures the heading text after the leading '#'s
+HEADER_RE = re.compile(r"^[^\S\n]*#+(.*)$", re.MULTILINE)
 
 # Initialize Sentence Transformer model
 embedding_model = None
 
 
+class OnnxEmbeddingModel:
+    """
+    ONNX Runtime drop-in for SentenceTransformer('all-mpnet-base-v2').encode.
+
+    Expects a directory produced by:
+        optimum-cli export onnx --model sentence-transformers/all-mpnet-base-v2 \
+            --task feature-extraction --optimize O3 onnx/
+        optimum-cli onnxruntime quantize --avx512_vnni --onnx_model onnx/ -o onnx/
+
+    Quantizing into the export directory keeps the tokenizer files next to the
+    model. The int8 `model_quantized.onnx` is used when present, otherwise
+    `model.onnx`.
+    Mean pooling and L2 normalization match the Sentence Transformers pipeline.
+    """
+
+    def __init__(self, model_dir: str, max_seq_length: int = 384):
+        # Optional dependencies, only needed when EMBEDDING_ONNX_DIR is set
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = Path(model_dir) / "model_quantized.onnx"
+        if not model_path.exists():
+            model_path = Path(model_dir) / "model.onnx"
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = EMBEDDING_THREADS
+        options.inter_op_num_threads = 1
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(
+            str(model_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.max_seq_length = max_seq_length
+
+    def encode(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+        normalize_embeddings: bool = True
+    ) -> np.ndarray:
+        # Length-sorted minibatches keep per-batch padding small
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+
+        starts = range(0, len(texts), batch_size)
+        for start in tqdm(starts, desc="Embedding batches", disable=not show_progress_bar):
+            idx = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [texts[i] for i in idx],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            inputs = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            embeddings[idx] = pooled
+
+        return embeddings
+
+
 def get_embedding_model():
-    """Lazy initialization of embedding model."""
+    """Lazy initialization of embedding model (ONNX Runtime when EMBEDDING_ONNX_DIR is set)."""
     global embedding_model
     if embedding_model is None:
-        print("🔧 Loading Sentence Transformer model (all-mpnet-base-v2)...")
-        embedding_model = SentenceTransformer('all-mpnet-base-v2')
+        if EMBEDDING_ONNX_DIR:
+            print(f"🔧 Loading ONNX embedding model from {EMBEDDING_ONNX_DIR}...")
+            embedding_model = OnnxEmbeddingModel(EMBEDDING_ONNX_DIR)
+        else:
+            import torch
+
+            # Containers often default torch to a single intra-op thread
+            torch.set_num_threads(EMBEDDING_THREADS)
+            torch.set_num_interop_threads(1)
+
+            print(f"🔧 Loading Sentence Transformer model (all-mpnet-base-v2, threads={EMBEDDING_THREADS})...")
+            embedding_model = SentenceTransformer('all-mpnet-base-v2')
         print("✅ Embedding model loaded")
     return embedding_model
 
@@ -71,45 +191,47 @@ def validate_config():
     print("✅ Configuration validated")
 
 
+def read_markdown_file(file_path: Path) -> Optional[Dict[str, str]]:
+    """
+    Read a single markdown file.
+
+    Returns:
+        Dict with 'path', 'content', 'filename' keys, or None if unreadable
+    """
+    try:
+        return {
+            'path': str(file_path),
+            'content': file_path.read_text(encoding='utf-8'),
+            'filename': file_path.name
+        }
+    except Exception as e:
+        print(f"⚠️  Warning: Could not read {file_path}: {e}")
+        return None
+
+
 def read_markdown_files(docs_dir: Path) -> List[Dict[str, str]]:
     """
     Recursively read all markdown files from the docs directory.
 
+    Files are found in a single directory walk and read concurrently.
+
     Returns:
         List of dicts with 'path', 'content', 'filename' keys
     """
-    markdown_files = []
     docs_path = Path(docs_dir)
 
     if not docs_path.exists():
         print(f"❌ Error: Docs directory not found: {docs_dir}")
         sys.exit(1)
 
-    # Find all .md and .mdx files recursively
-    for file_path in docs_path.rglob("*.md"):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                markdown_files.append({
-                    'path': str(file_path),
-                    'content': content,
-                    'filename': file_path.name
-                })
-        except Exception as e:
-            print(f"⚠️  Warning: Could not read {file_path}: {e}")
+    # Find all .md and .mdx (Docusaurus) files recursively
+    paths = [
+        p for p in docs_path.rglob("*")
+        if p.suffix in MARKDOWN_SUFFIXES and p.is_file()
+    ]
 
-    # Also check for .mdx files (Docusaurus)
-    for file_path in docs_path.rglob("*.mdx"):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                markdown_files.append({
-                    'path': str(file_path),
-                    'content': content,
-                    'filename': file_path.name
-                })
-        except Exception as e:
-            print(f"⚠️  Warning: Could not read {file_path}: {e}")
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        markdown_files = [doc for doc in executor.map(read_markdown_file, paths) if doc is not None]
 
     print(f"📄 Found {len(markdown_files)} markdown files")
     return markdown_files
@@ -119,35 +241,24 @@ def split_by_headers(content: str) -> List[Dict[str, str]]:
     """
     Split markdown content by headers to preserve document structure.
 
+    Any line starting with '#' (after leading whitespace) is a header.
+    Sections without text are dropped.
+
     Returns:
         List of sections with 'heading' and 'text' keys
     """
-    sections = []
-    lines = content.split('\n')
-    current_heading = "Introduction"
-    current_text = []
-
-    for line in lines:
-        # Check if line is a header (# or ##)
-        if line.strip().startswith('#'):
-            # Save previous section
-            if current_text:
-                sections.append({
-                    'heading': current_heading,
-                    'text': '\n'.join(current_text).strip()
-                })
-            # Start new section
-            current_heading = line.strip().lstrip('#').strip()
-            current_text = []
-        else:
-            current_text.append(line)
+    # parts = [text, heading, text, heading, text, ...]
+    parts = HEADER_RE.split(content)
+    headings = ["Introduction"] + parts[1::2]
 
-    # Save last section
-    if current_text:
-        sections.append({
-            'heading': current_heading,
-            'text': '\n'.join(current_text).strip()
-        })
+    sections = []
+    for heading, text in zip(headings, parts[0::2]):
+        text = text.strip()
+        if text:
+            sections.append({
+                'heading': heading.strip(),
+                'text': text
+            })
 
     return sections
 
@@ -171,20 +282,22 @@ def chunk_document(
         overlap: Overlap tokens between chunks (default: 150)
 
     Returns:
-        List of chunk dicts with text and metadata
+        List of chunk dicts with text and chunk fields; 'section_metadata' is
+        one dict shared by every chunk of a section (see chunk_payload)
     """
-    tokenizer = tiktoken.get_encoding("cl100k_base")
     sections = split_by_headers(content)
 
+    # Tokenize every section in one parallel call
+    all_section_tokens = TOKENIZER.encode_batch(
+        [section["text"] for section in sections],
+        num_threads=TOKENIZER_THREADS
+    )
+
     chunks = []
     chunk_id = 0
 
-    for section in sections:
+    for section, section_tokens in zip(sections, all_section_tokens):
         section_text = section["text"]
-        if not section_text.strip():
-            continue
-
-        section_tokens = tokenizer.encode(section_text)
         section_metadata = {
             **metadata,
             "section": section["heading"]
@@ -195,64 +308,88 @@ def chunk_document(
             if len(section_tokens) >= 100:  # Skip very small sections
                 chunks.append({
                     "text": section_text,
-                    "metadata": {
-                        **section_metadata,
-                        "chunk_id": chunk_id,
-                        "token_count": len(section_tokens),
-                        "start_token": 0,
-                        "end_token": len(section_tokens)
-                    }
+                    "section_metadata": section_metadata,
+                    "chunk_id": chunk_id,
+                    "token_count": len(section_tokens),
+                    "start_token": 0,
+                    "end_token": len(section_tokens)
                 })
                 chunk_id += 1
         else:
+            # Byte offset of every token boundary: window text is sliced from the
+            # section's UTF-8 bytes, which is exactly what decoding the window yields
+            section_bytes = section_text.encode("utf-8")
+            offsets = [0, *accumulate(map(len, TOKENIZER.decode_tokens_bytes(section_tokens)))]
+
             # Split large sections with sliding window
             step = chunk_size - overlap
             for i, start in enumerate(range(0, len(section_tokens), step)):
                 end = min(start + chunk_size, len(section_tokens))
-                chunk_tokens = section_tokens[start:end]
 
                 # Skip chunks that are too small (at the end)
-                if len(chunk_tokens) < 100:
+                if end - start < 100:
                     break
 
-                chunk_text = tokenizer.decode(chunk_tokens)
+                chunk_text = section_bytes[offsets[start]:offsets[end]].decode("utf-8", errors="replace")
                 chunks.append({
                     "text": chunk_text,
-                    "metadata": {
-                        **section_metadata,
-                        "chunk_id": chunk_id,
-                        "token_count": len(chunk_tokens),
-                        "start_token": start,
-                        "end_token": end,
-                        "is_continuation": i > 0
-                    }
+                    "section_metadata": section_metadata,
+                    "chunk_id": chunk_id,
+                    "token_count": end - start,
+                    "start_token": start,
+                    "end_token": end,
+                    "is_continuation": i > 0
                 })
                 chunk_id += 1
 
     return chunks
 
 
-def generate_embeddings_batch(texts: List[str], retry_count: int = 3) -> List[List[float]]:
+def chunk_payload(chunk: Dict) -> Dict:
+    """
+    Flatten a chunk into its Qdrant payload (text, section metadata, chunk fields).
+    """
+    payload = {**chunk["section_metadata"], **chunk}
+    del payload["section_metadata"]
+    return payload
+
+
+def generate_embeddings_batch(
+    texts: List[str],
+    retry_count: int = 3,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    show_progress_bar: bool = False
+) -> np.ndarray:
     """
     Generate embeddings for a batch of texts using Sentence Transformers.
 
-    Uses exponential backoff retry for error handling.
+    Sentence Transformers sorts the texts by length before splitting them into
+    minibatches of `batch_size`, so passing many texts per call keeps padding
+    (and wasted compute) low. Vectors are L2-normalized, which lets the
+    collection use dot-product distance. Uses exponential backoff retry for
+    error handling.
 
     Args:
         texts: List of text strings to embed
         retry_count: Number of retries on failure
+        batch_size: Minibatch size used by the model forward pass
+        show_progress_bar: Display the model's own progress bar
 
     Returns:
-        List of embedding vectors (768-dim each)
+        Array of shape (len(texts), 768) with one embedding per row
     """
     model = get_embedding_model()
 
     for attempt in range(retry_count):
         try:
             # Generate embeddings using Sentence Transformers
-            embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
-            # Convert numpy arrays to lists
-            return [embedding.tolist() for embedding in embeddings]
+            return model.encode(
+                texts,
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=show_progress_bar
+            )
 
         except Exception as e:
             wait_time = 2 ** attempt  # Exponential backoff
@@ -265,7 +402,66 @@ def generate_embeddings_batch(texts: List[str], retry_count: int = 3) -> List[Li
                 raise
 
 
-def create_qdrant_collection(client: QdrantClient, collection_name: str, force: bool = False):
+def generate_embeddings_cached(
+    texts: List[str],
+    cache_path: str = EMBEDDING_CACHE_PATH
+) -> np.ndarray:
+    """
+    Generate embeddings, reusing vectors cached on disk by content hash.
+
+    Each text is keyed by a BLAKE2b digest of the model identity and the text,
+    so unchanged chunks are not re-embedded when the corpus is re-ingested.
+    Only cache misses are passed to generate_embeddings_batch.
+
+    Args:
+        texts: List of text strings to embed
+        cache_path: SQLite file holding hash -> float32 vector bytes
+
+    Returns:
+        Array of shape (len(texts), 768) with one embedding per row
+    """
+    model_id = EMBEDDING_ONNX_DIR or "all-mpnet-base-v2"
+    keys = [
+        hashlib.blake2b(f"{model_id}\n{text}".encode("utf-8"), digest_size=16).digest()
+        for text in texts
+    ]
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+
+    with closing(sqlite3.connect(cache_path)) as db:
+        db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+
+        cached = {}
+        for i in range(0, len(keys), 500):  # Stay below SQLite's bound-parameter limit
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            cached.update(db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ))
+
+        misses = []
+        for i, key in enumerate(keys):
+            if key in cached:
+                embeddings[i] = np.frombuffer(cached[key], dtype=np.float32)
+            else:
+                misses.append(i)
+
+        print(f"💾 Embedding cache: {len(texts) - len(misses)} hits, {len(misses)} misses")
+
+        if misses:
+            embeddings[misses] = generate_embeddings_batch(
+                [texts[i] for i in misses],
+                show_progress_bar=True
+            )
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    ((keys[i], embeddings[i].tobytes()) for i in misses)
+                )
+
+    return embeddings
+
+
+def create_qdrant_collection(client: QdrantClient, collection_name: str, force: bool = False) -> bool:
     """
     Create Qdrant collection with proper configuration.
 
@@ -273,6 +469,10 @@ def create_qdrant_collection(client: QdrantClient, collection_name: str, force:
         client: Qdrant client instance
         collection_name: Name of collection to create
         force: If True, delete existing collection first
+
+    Returns:
+        True if the collection was created (with indexing deferred), False if
+        an existing collection was kept
     """
     try:
         # Check if collection exists
@@ -285,67 +485,109 @@ def create_qdrant_collection(client: QdrantClient, collection_name: str, force:
                 client.delete_collection(collection_name)
             else:
                 print(f"✅ Collection '{collection_name}' already exists (use --force to recreate)")
-                return
+                return False
 
-        # Create collection with HNSW indexing
+        # Create collection with HNSW indexing deferred until the bulk upload is done
         print(f"🔧 Creating collection: {collection_name}")
         client.create_collection(
             collection_name=collection_name,
+            # Embeddings are unit-length, so dot product equals cosine similarity
             vectors_config=VectorParams(
                 size=EMBEDDING_DIM,
-                distance=Distance.COSINE
+                distance=Distance.DOT,
+                on_disk=True
+            ),
+            optimizers_config=OptimizersConfigDiff(indexing_threshold=0),
+            # int8 copies of the vectors stay in RAM for search; float32 originals on disk for rescoring
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
             )
         )
         print(f"✅ Collection created successfully")
+        return True
 
     except Exception as e:
         print(f"❌ Error creating collection: {e}")
         sys.exit(1)
 
 
-def upload_to_qdrant(
-    client: QdrantClient,
+def enable_indexing(client: QdrantClient, collection_name: str):
+    """
+    Re-enable HNSW indexing so the index is built once over the uploaded points.
+
+    Args:
+        client: Qdrant client instance
+        collection_name: Name of collection to index
+    """
+    try:
+        print(f"🔧 Enabling HNSW indexing (indexing_threshold={INDEXING_THRESHOLD})...")
+        client.update_collection(
+            collection_name=collection_name,
+            optimizer_config=OptimizersConfigDiff(indexing_threshold=INDEXING_THRESHOLD)
+        )
+        print("✅ Indexing enabled")
+
+    except Exception as e:
+        print(f"❌ Error enabling indexing: {e}")
+        raise
+
+
+async def upload_to_qdrant(
+    client: AsyncQdrantClient,
     collection_name: str,
     chunks: List[Dict],
-    batch_size: int = BATCH_SIZE
+    vectors: np.ndarray,
+    batch_size: int = BATCH_SIZE,
+    parallel: int = UPLOAD_PARALLEL
 ):
     """
-    Upload chunks with embeddings to Qdrant in batches.
+    Upload chunks with embeddings to Qdrant in concurrent batches.
+
+    Batches are upserted through the async client with at most `parallel`
+    requests in flight, so network round-trips to Qdrant Cloud overlap.
 
     Args:
-        client: Qdrant client instance
+        client: Async Qdrant client instance
         collection_name: Target collection name
-        chunks: List of chunks with 'text', 'embedding', 'metadata'
+        chunks: List of chunks as returned by chunk_document
+        vectors: Embedding array of shape (len(chunks), 768), row i for chunks[i]
         batch_size: Number of chunks per batch
+        parallel: Maximum number of concurrent upsert requests
     """
-    print(f"⬆️  Uploading {len(chunks)} chunks to Qdrant...")
-
-    for i in tqdm(range(0, len(chunks), batch_size), desc="Uploading batches"):
-        batch = chunks[i:i + batch_size]
-
-        points = [
-            PointStruct(
-                id=i + j,
-                vector=chunk["embedding"],
-                payload={
-                    "text": chunk["text"],
-                    **chunk["metadata"]
-                }
-            )
-            for j, chunk in enumerate(batch)
-        ]
+    print(f"⬆️  Uploading {len(chunks)} chunks to Qdrant (parallel={parallel})...")
+
+    semaphore = asyncio.Semaphore(parallel)
+    starts = range(0, len(chunks), batch_size)
+
+    async def upload_batch(start: int):
+        async with semaphore:
+            end = start + batch_size
+            points = [
+                PointStruct(
+                    id=start + j,
+                    vector=vector,
+                    payload=chunk_payload(chunk)
+                )
+                for j, (chunk, vector) in enumerate(zip(chunks[start:end], vectors[start:end].tolist()))
+            ]
+
+            try:
+                await client.upsert(
+                    collection_name=collection_name,
+                    points=points
+                )
+            except Exception as e:
+                print(f"\n❌ Error uploading batch {start // batch_size}: {e}")
+                raise
 
-        try:
-            client.upsert(
-                collection_name=collection_name,
-                points=points
-            )
-            # Rate limiting delay
-            time.sleep(BATCH_DELAY)
+            progress.update(1)
 
-        except Exception as e:
-            print(f"\n❌ Error uploading batch {i // batch_size}: {e}")
-            raise
+    with tqdm(total=len(starts), desc="Uploading batches") as progress:
+        await asyncio.gather(*(upload_batch(start) for start in starts))
 
     print(f"✅ Successfully uploaded {len(chunks)} chunks")
 
@@ -369,6 +611,11 @@ def main():
         default=COLLECTION_NAME,
         help=f"Qdrant collection name (default: {COLLECTION_NAME})"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"Re-embed every chunk instead of reusing {EMBEDDING_CACHE_PATH}"
+    )
 
     args = parser.parse_args()
 
@@ -393,7 +640,7 @@ def main():
         sys.exit(1)
 
     # Step 4: Create/verify collection
-    create_qdrant_collection(qdrant, args.collection_name, force=args.force)
+    created = create_qdrant_collection(qdrant, args.collection_name, force=args.force)
 
     # Step 5: Read markdown files
     print(f"\n📖 Reading markdown files from: {args.docs_dir}")
@@ -417,25 +664,30 @@ def main():
 
     print(f"✅ Created {len(all_chunks)} chunks from {len(documents)} documents")
 
-    # Step 7: Generate embeddings
-    print(f"\n🧠 Generating embeddings (batch_size={BATCH_SIZE})...")
-
-    for i in tqdm(range(0, len(all_chunks), BATCH_SIZE), desc="Embedding batches"):
-        batch = all_chunks[i:i + BATCH_SIZE]
-        texts = [chunk["text"] for chunk in batch]
-
-        embeddings = generate_embeddings_batch(texts)
+    # Step 7: Generate embeddings (single call so the model sees every chunk)
+    print(f"\n🧠 Generating embeddings (batch_size={EMBEDDING_BATCH_SIZE})...")
 
-        for chunk, embedding in zip(batch, embeddings):
-            chunk["embedding"] = embedding
-
-        # Rate limiting delay
-        time.sleep(BATCH_DELAY)
+    texts = [chunk["text"] for chunk in all_chunks]
+    if args.no_cache:
+        embeddings = generate_embeddings_batch(texts, show_progress_bar=True)
+    else:
+        embeddings = generate_embeddings_cached(texts)
 
     print(f"✅ Generated embeddings for {len(all_chunks)} chunks")
 
     # Step 8: Upload to Qdrant
-    upload_to_qdrant(qdrant, args.collection_name, all_chunks)
+    async def upload():
+        # Closed inside the event loop so its connection pool is released cleanly
+        async_qdrant = AsyncQdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=60, prefer_grpc=False)
+        try:
+            await upload_to_qdrant(async_qdrant, args.collection_name, all_chunks, embeddings)
+        finally:
+            await async_qdrant.close()
+
+    asyncio.run(upload())
+    # Only a collection created above has indexing deferred; keep an existing one's settings
+    if created:
+        enable_indexing(qdrant, args.collection_name)
 
     # Step 9: Verify ingestion
     print(f"\n🔍 Verifying ingestion...")
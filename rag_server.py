@@ -7,20 +7,34 @@ Modes:
 
 Endpoints:
 - POST /api/query
+- POST /api/query_batch
+- POST /api/query_stream (Server-Sent Events)
+- POST /api/cache/clear
+- GET  /api/cache/stats
 - GET  /api/health
 """
 
 import os
+import sys
 import time
-from typing import Optional, List
+import logging
+import secrets
+import hashlib
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, List, AsyncIterator, Dict, Tuple
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 import google.generativeai as genai
-from qdrant_client import QdrantClient
+from google.api_core import exceptions as gax
+from google.generativeai.types.generation_types import BlockedPromptException
+from qdrant_client import AsyncQdrantClient
 
 # ------------------------------------------------------------------
 # ENV
@@ -28,22 +42,55 @@ from qdrant_client import QdrantClient
 
 load_dotenv()
 
+logger = logging.getLogger("rag_server")
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "robotics_textbook_chunks")
 
 TOP_K = int(os.getenv("TOP_K_RESULTS", "5"))
-MAX_CONTEXT_LENGTH = int(os.getenv("MAX_CONTEXT_LENGTH", "4000"))
+# MAX_CONTEXT_LENGTH (characters) is the old name; ~4 characters per token
+MAX_CONTEXT_TOKENS = int(
+    os.getenv("MAX_CONTEXT_TOKENS")
+    or int(os.getenv("MAX_CONTEXT_LENGTH", "4000")) // 4
+)
+# Chunks left with fewer new characters than this after overlap removal are dropped
+MIN_UNIQUE_CHUNK_CHARS = 50
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "300"))
+# Minimum Jaccard overlap between cached and current source chunks to reuse an answer
+ANSWER_CACHE_MIN_OVERLAP = 0.8
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "10"))
+CACHE_ADMIN_TOKEN = os.getenv("CACHE_ADMIN_TOKEN")
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "*").split(",")
 
 # ------------------------------------------------------------------
 # APP
 # ------------------------------------------------------------------
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the Qdrant gRPC channel and prime the retrieval cache at boot,
+    # so the first request does not pay for either
+    try:
+        await qdrant_fallback_search()
+    except Exception:
+        pass  # Unreachable or not configured; /api/health reports it as degraded
+    yield
+
+    global _qdrant_client
+    if _qdrant_client is not None:
+        await _qdrant_client.close()
+        _qdrant_client = None
+
+
 app = FastAPI(
     title="AI Robotics RAG API",
     version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -63,23 +110,26 @@ if not GEMINI_API_KEY:
 
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Shared by every request; construction is not free
+_gemini_model = genai.GenerativeModel("models/gemini-2.5-flash")
+
 # ------------------------------------------------------------------
 # QDRANT (lazy)
 # ------------------------------------------------------------------
 
-_qdrant_client: Optional[QdrantClient] = None
+_qdrant_client: Optional[AsyncQdrantClient] = None
 
 
-def get_qdrant_client() -> QdrantClient:
+def get_qdrant_client() -> AsyncQdrantClient:
     global _qdrant_client
     if _qdrant_client is None:
         if not QDRANT_URL or not QDRANT_API_KEY:
             raise HTTPException(503, "Qdrant not configured")
-        _qdrant_client = QdrantClient(
+        _qdrant_client = AsyncQdrantClient(
             url=QDRANT_URL,
             api_key=QDRANT_API_KEY,
             timeout=30,
-            prefer_grpc=False,
+            prefer_grpc=True,
         )
     return _qdrant_client
 
@@ -93,6 +143,10 @@ class QueryRequest(BaseModel):
     selectedText: Optional[str] = None
 
 
+class QueryBatchRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUESTIONS)
+
+
 class Source(BaseModel):
     source: str
     chunk_text: str
@@ -119,62 +173,284 @@ class HealthResponse(BaseModel):
 # HELPERS
 # ------------------------------------------------------------------
 
-async def qdrant_fallback_search(limit: int = TOP_K) -> List[dict]:
+def approx_tokens(text: str) -> int:
+    # Roughly four characters per token for English text
+    return (len(text) + 3) // 4
+
+
+async def count_chunk_tokens(docs: List[dict]) -> None:
+    """
+    Store Gemini's token count for each chunk as d["tokens"].
+
+    Runs once per retrieval-cache fill; falls back to an estimate if the
+    count_tokens call fails.
+    """
+    async def count(text: str) -> int:
+        if not text:
+            return 0
+        # count_tokens_async needs the client that only the sync API sets up
+        try:
+            return (await asyncio.to_thread(_gemini_model.count_tokens, text)).total_tokens
+        except Exception:
+            logger.warning("Gemini count_tokens failed; estimating chunk tokens", exc_info=True)
+            return approx_tokens(text)
+
+    counts = await asyncio.gather(*(count(d["text"]) for d in docs))
+    for d, tokens in zip(docs, counts):
+        d["tokens"] = tokens
+
+
+# limit -> (fetched_at, results, sources); scroll results do not depend on the question
+_retrieval_cache: Dict[int, Tuple[float, List[dict], List[Source]]] = {}
+
+
+async def qdrant_fallback_search(limit: int = TOP_K) -> Tuple[List[dict], List[Source]]:
     """
     Safe scroll-based retrieval (NO embeddings, NO memory spikes).
+
+    Returns the retrieved chunks and their response `Source` list; both are
+    reused for RETRIEVAL_CACHE_TTL seconds.
     """
+    cached = _retrieval_cache.get(limit)
+    if cached and time.monotonic() - cached[0] < RETRIEVAL_CACHE_TTL:
+        return cached[1], cached[2]
+
     client = get_qdrant_client()
-    points, _ = client.scroll(
+    points, _ = await client.scroll(
         collection_name=COLLECTION_NAME,
         limit=limit,
         with_payload=True,
     )
 
+    # Sources and sections repeat across chunks; intern them so every hit
+    # shares one string per distinct value
     results = []
     for p in points:
         payload = p.payload or {}
+        text = payload.get("text", "")
+        section = payload.get("section")
         results.append({
-            "text": payload.get("text", ""),
-            "source": payload.get("source", "unknown"),
-            "section": payload.get("section"),
+            # Point ids are assigned by position at ingest, so they survive a
+            # re-ingest that changes the text; the answer cache keys on content
+            "text_hash": hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(),
+            "text": text,
+            "source": sys.intern(payload.get("source", "unknown")),
+            "section": sys.intern(section) if section else None,
             "score": 1.0,
         })
 
-    return results
+    await count_chunk_tokens(results)
+    sources = build_sources(results)
+    if results:
+        _retrieval_cache[limit] = (time.monotonic(), results, sources)
 
+    return results, sources
 
-def build_prompt(question: str, context: str, selected: bool) -> str:
-    if selected:
-        return f"""
+
+# normalized question -> (stored_at, answer, source chunk text hashes), in LRU order
+_answer_cache: "OrderedDict[str, Tuple[float, str, frozenset]]" = OrderedDict()
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def _lookup_answer(key: str, current_hashes: set) -> Optional[str]:
+    entry = _answer_cache.get(key)
+    if entry is None:
+        return None
+
+    stored_at, answer, source_hashes = entry
+    if time.monotonic() - stored_at >= ANSWER_CACHE_TTL:
+        del _answer_cache[key]
+        return None
+
+    overlap = len(source_hashes & current_hashes) / len(source_hashes | current_hashes)
+    if overlap < ANSWER_CACHE_MIN_OVERLAP:
+        return None
+
+    _answer_cache.move_to_end(key)
+    return answer
+
+
+def get_cached_answer(question: str, docs: List[dict]) -> Optional[str]:
+    """
+    Return a cached answer if it is fresh and was grounded in (nearly) the
+    same chunk text that retrieval returns now.
+    """
+    key = normalize_question(question)
+    current_hashes = {d["text_hash"] for d in docs}
+
+    answer = _lookup_answer(key, current_hashes)
+    if answer is not None:
+        _cache_stats["hits"] += 1
+        return answer
+
+    _cache_stats["misses"] += 1
+    return None
+
+
+def store_answer(question: str, docs: List[dict], answer: str) -> None:
+    key = normalize_question(question)
+    _answer_cache[key] = (time.monotonic(), answer, frozenset(d["text_hash"] for d in docs))
+    _answer_cache.move_to_end(key)
+
+    while len(_answer_cache) > ANSWER_CACHE_SIZE:
+        _answer_cache.popitem(last=False)
+
+
+def trim_overlap(previous: str, text: str, probe: int = 32) -> str:
+    """
+    Drop the start of `text` that repeats the end of `previous`.
+
+    Adjacent sliding-window chunks share their overlap tokens verbatim.
+    """
+    head = text[:probe]
+    pos = previous.find(head)
+    while pos != -1:
+        if text.startswith(previous[pos:]):
+            return text[len(previous) - pos:]
+        pos = previous.find(head, pos + 1)
+    return text
+
+
+def build_context(docs: List[dict]) -> str:
+    """
+    Join retrieved chunks in rank order within MAX_CONTEXT_TOKENS tokens.
+
+    Text a chunk shares with an earlier chunk is sent once; chunks with almost
+    nothing new are skipped. The chunk that crosses the budget is cut; later
+    chunks are never formatted.
+    """
+    parts = []
+    seen_texts = []
+    remaining = MAX_CONTEXT_TOKENS
+
+    for d in docs:
+        text = d["text"]
+        for previous in seen_texts:
+            text = trim_overlap(previous, text)
+        seen_texts.append(d["text"])
+
+        if len(text) < len(d["text"]) and len(text.strip()) < MIN_UNIQUE_CHUNK_CHARS:
+            continue
+
+        header = f"[{d['source']}]\n"
+        remaining -= approx_tokens(header)
+        if remaining <= 0:
+            break
+
+        # Scale the chunk's counted tokens to what is left after overlap removal
+        tokens = d.get("tokens")
+        if tokens is None:
+            tokens = approx_tokens(d["text"])
+        if len(text) < len(d["text"]):
+            tokens = -(-tokens * len(text) // len(d["text"]))
+
+        if tokens > remaining:
+            text = text[:len(text) * remaining // tokens]
+            tokens = remaining
+        parts.append(header + text)
+
+        remaining -= tokens + 1  # "\n\n" separator before the next chunk
+        if remaining <= 0:
+            break
+
+    return "\n\n".join(parts)
+
+
+def build_sources(docs: List[dict]) -> List[Source]:
+    texts = [d["text"] for d in docs]
+    paths = [d["source"] for d in docs]
+    sections = [d.get("section") for d in docs]
+    scores = [d["score"] for d in docs]
+
+    return [
+        Source(source=path, chunk_text=text[:200], score=score, section=section)
+        for path, text, score, section in zip(paths, texts, scores, sections)
+    ]
+
+
+# Fixed prompt fragments; build_prompt only joins them around the variable parts
+_PROMPT_SELECTED_HEAD = """
 You are an AI Robotics tutor.
 
 Highlighted text:
-{context}
-
-Question:
-{question}
+"""
+_PROMPT_SELECTED_TAIL = """
 
 Explain clearly in simple terms.
 """
-    return f"""
+_PROMPT_RAG_HEAD = """
 You are an AI assistant for an AI Robotics textbook.
 
 Context:
-{context}
-
-Question:
-{question}
+"""
+_PROMPT_RAG_TAIL = """
 
 Answer clearly and concisely.
 """
+_PROMPT_QUESTION = """
+
+Question:
+"""
+
+
+def build_prompt(question: str, context: str, selected: bool) -> str:
+    if selected:
+        head, tail = _PROMPT_SELECTED_HEAD, _PROMPT_SELECTED_TAIL
+    else:
+        head, tail = _PROMPT_RAG_HEAD, _PROMPT_RAG_TAIL
+    return "".join((head, context, _PROMPT_QUESTION, question, tail))
 
 
 async def generate_answer(prompt: str) -> str:
-    model = genai.GenerativeModel("models/gemini-2.5-flash")
-    response = model.generate_content(prompt)
-    if not response or not response.text:
+    try:
+        response = await _gemini_model.generate_content_async(prompt)
+    except gax.ResourceExhausted:
+        raise HTTPException(429, "API rate limit exceeded. Please try again in a moment.")
+
+    # A blocked prompt is not raised here; it comes back without candidates
+    if response.prompt_feedback.block_reason:
+        raise HTTPException(400, "Question was blocked by Gemini safety filters")
+    try:
+        text = response.text
+    except ValueError:
+        # Candidate without text parts, e.g. the answer itself was blocked
         raise HTTPException(500, "Empty response from Gemini")
-    return response.text.strip()
+    if not text:
+        raise HTTPException(500, "Empty response from Gemini")
+    return text.strip()
+
+
+def sse_event(data: str, event: Optional[str] = None) -> str:
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_answer(prompt: str) -> AsyncIterator[str]:
+    """
+    Yield Gemini output as Server-Sent Events while it is generated.
+    """
+    try:
+        response = await _gemini_model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield sse_event(chunk.text)
+    except gax.ResourceExhausted:
+        yield sse_event("API rate limit exceeded. Please try again in a moment.", event="error")
+        return
+    except BlockedPromptException:
+        yield sse_event("Question was blocked by Gemini safety filters", event="error")
+        return
+    except Exception:
+        logger.exception("Gemini streaming failed")
+        yield sse_event("Failed to generate answer", event="error")
+        return
+
+    yield sse_event("", event="done")
 
 
 # ------------------------------------------------------------------
@@ -205,30 +481,17 @@ async def query(request: QueryRequest):
         )
 
     # ---------------- Normal RAG Mode ----------------
-    docs = await qdrant_fallback_search()
+    docs, sources = await qdrant_fallback_search()
 
     if not docs:
         raise HTTPException(404, "No content found")
 
-    context = "\n\n".join(
-        f"[{d['source']}]\n{d['text']}" for d in docs
-    )
-
-    if len(context) > MAX_CONTEXT_LENGTH:
-        context = context[:MAX_CONTEXT_LENGTH]
-
-    prompt = build_prompt(request.question, context, selected=False)
-    answer = await generate_answer(prompt)
-
-    sources = [
-        Source(
-            source=d["source"],
-            chunk_text=d["text"][:200],
-            score=d["score"],
-            section=d.get("section"),
-        )
-        for d in docs
-    ]
+    answer = get_cached_answer(request.question, docs)
+    if answer is None:
+        context = build_context(docs)
+        prompt = build_prompt(request.question, context, selected=False)
+        answer = await generate_answer(prompt)
+        store_answer(request.question, docs, answer)
 
     return QueryResponse(
         answer=answer,
@@ -238,6 +501,96 @@ async def query(request: QueryRequest):
     )
 
 
+@app.post("/api/query_batch", response_model=List[QueryResponse])
+async def query_batch(request: QueryBatchRequest):
+    start = time.time()
+
+    if not all(q.strip() for q in request.questions):
+        raise HTTPException(400, "Questions cannot be empty")
+
+    # One Qdrant round-trip shared by every question
+    docs, sources = await qdrant_fallback_search()
+
+    if not docs:
+        raise HTTPException(404, "No content found")
+
+    context = build_context(docs)
+
+    async def answer_question(question: str) -> QueryResponse:
+        answer = get_cached_answer(question, docs)
+        if answer is None:
+            prompt = build_prompt(question, context, selected=False)
+            answer = await generate_answer(prompt)
+            store_answer(question, docs, answer)
+
+        return QueryResponse(
+            answer=answer,
+            mode="normal_rag",
+            sources=sources,
+            response_time_ms=int((time.time() - start) * 1000),
+        )
+
+    # Repeats within the batch would all miss the cache before any answer is
+    # stored, so each distinct question is asked once; results keep request order
+    keys = [normalize_question(q) for q in request.questions]
+    unique = dict(zip(keys, request.questions))
+    answered = await asyncio.gather(*(answer_question(q) for q in unique.values()))
+    by_key = dict(zip(unique, answered))
+    return [by_key[k] for k in keys]
+
+
+@app.post("/api/query_stream")
+async def query_stream(request: QueryRequest):
+    if not request.question.strip():
+        raise HTTPException(400, "Question cannot be empty")
+
+    if request.selectedText and request.selectedText.strip():
+        prompt = build_prompt(
+            request.question,
+            request.selectedText.strip(),
+            selected=True,
+        )
+    else:
+        docs, _ = await qdrant_fallback_search()
+
+        if not docs:
+            raise HTTPException(404, "No content found")
+
+        prompt = build_prompt(request.question, build_context(docs), selected=False)
+
+    return StreamingResponse(stream_answer(prompt), media_type="text/event-stream")
+
+
+@app.post("/api/cache/clear")
+async def clear_cache(x_admin_token: Optional[str] = Header(None)):
+    """
+    Drop cached retrieval results and answers (e.g. after re-ingesting).
+    """
+    if not CACHE_ADMIN_TOKEN:
+        raise HTTPException(403, "Cache clearing is disabled (CACHE_ADMIN_TOKEN not set)")
+    # Bytes, since compare_digest rejects non-ASCII str from a crafted header
+    if not secrets.compare_digest((x_admin_token or "").encode(), CACHE_ADMIN_TOKEN.encode()):
+        raise HTTPException(403, "Invalid admin token")
+
+    cleared = {
+        "retrieval_entries": len(_retrieval_cache),
+        "answer_entries": len(_answer_cache),
+    }
+    _retrieval_cache.clear()
+    _answer_cache.clear()
+
+    return {"cleared": cleared}
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {
+        **_cache_stats,
+        "answer_entries": len(_answer_cache),
+        "retrieval_entries": len(_retrieval_cache),
+    }
+
+
 @app.get("/api/health", response_model=HealthResponse)
 async def health():
     qdrant_ok = False
@@ -245,7 +598,7 @@ async def health():
 
     try:
         client = get_qdrant_client()
-        info = client.get_collection(COLLECTION_NAME)
+        info = await client.get_collection(COLLECTION_NAME)
         qdrant_ok = True
         points = info.points_count
     except Exception: